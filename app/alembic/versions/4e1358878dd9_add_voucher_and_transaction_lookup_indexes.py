@@ -0,0 +1,44 @@
+"""Add voucher and transaction lookup indexes
+
+Revision ID: 4e1358878dd9
+Revises: b90d767a4c25
+Create Date: 2026-10-15 09:12:41.318204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4e1358878dd9'
+down_revision: Union[str, Sequence[str], None] = 'b90d767a4c25'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction, but avoids
+    # blocking writes to the tables while the indexes build
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_vouchers_account_status', 'vouchers', ['account_id', 'status'],
+            postgresql_concurrently=True
+        )
+        op.create_index(
+            'ix_transactions_status_created', 'transactions', ['status', 'created_at'],
+            postgresql_concurrently=True
+        )
+        op.create_index(
+            'ix_transactions_account_created', 'transactions', ['account_id', 'created_at'],
+            postgresql_concurrently=True
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_transactions_account_created', table_name='transactions', postgresql_concurrently=True)
+        op.drop_index('ix_transactions_status_created', table_name='transactions', postgresql_concurrently=True)
+        op.drop_index('ix_vouchers_account_status', table_name='vouchers', postgresql_concurrently=True)
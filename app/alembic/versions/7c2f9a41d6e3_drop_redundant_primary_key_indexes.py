@@ -0,0 +1,40 @@
+"""Drop redundant primary key indexes
+
+Revision ID: 7c2f9a41d6e3
+Revises: 4e1358878dd9
+Create Date: 2026-10-15 10:04:17.552930
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c2f9a41d6e3'
+down_revision: Union[str, Sequence[str], None] = '4e1358878dd9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Each id is already covered by its primary key index. IF EXISTS keeps this
+    # safe on databases where the indexes were dropped by hand.
+    with op.get_context().autocommit_block():
+        for table in ('transactions', 'vouchers', 'packages', 'accounts'):
+            op.drop_index(
+                f'ix_{table}_id', table_name=table,
+                if_exists=True, postgresql_concurrently=True
+            )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Restore the indexes the initial migration created
+    with op.get_context().autocommit_block():
+        for table in ('accounts', 'packages', 'vouchers', 'transactions'):
+            op.create_index(
+                f'ix_{table}_id', table, ['id'],
+                if_not_exists=True, postgresql_concurrently=True
+            )
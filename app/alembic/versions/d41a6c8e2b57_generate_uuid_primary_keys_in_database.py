@@ -0,0 +1,31 @@
+"""Generate UUID primary keys in the database
+
+Revision ID: d41a6c8e2b57
+Revises: 7c2f9a41d6e3
+Create Date: 2026-10-15 11:37:52.804416
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd41a6c8e2b57'
+down_revision: Union[str, Sequence[str], None] = '7c2f9a41d6e3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # gen_random_uuid() is built in from PostgreSQL 13
+    for table in ('accounts', 'vouchers', 'transactions'):
+        op.alter_column(table, 'id', server_default=sa.text('gen_random_uuid()'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table in ('transactions', 'vouchers', 'accounts'):
+        op.alter_column(table, 'id', server_default=None)
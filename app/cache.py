@@ -0,0 +1,44 @@
+"""
+In-process caches for data that is read far more often than it changes.
+Each worker process keeps its own copy, so entries are kept short-lived.
+"""
+
+import threading
+from cachetools import TTLCache
+
+
+class TTLStore:
+    """Thread-safe TTL cache (sync endpoints run in FastAPI's threadpool)"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            return self._cache.get(key, default)
+
+    def set(self, key, value):
+        with self._lock:
+            self._cache[key] = value
+
+    def pop(self, key):
+        with self._lock:
+            self._cache.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+# Admin dashboard counters are global and may be a few seconds stale
+dashboard_stats_cache = TTLStore(maxsize=1, ttl=30)
+
+# Validity of active vouchers, keyed by (mobile number, code); only valid results are stored
+voucher_validation_cache = TTLStore(maxsize=10_000, ttl=30)
+
+# Active packages change only through the admin package endpoints, which clear this
+active_packages_cache = TTLStore(maxsize=1, ttl=60)
+
+# Account id and expiry for recently verified access tokens, keyed by a digest of the token
+token_account_cache = TTLStore(maxsize=10_000, ttl=60)
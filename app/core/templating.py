@@ -0,0 +1,18 @@
+from fastapi.templating import Jinja2Templates
+from jinja2 import FileSystemBytecodeCache
+
+from app.core.config import get_settings
+
+# One Jinja environment shared by every router, so each template is compiled once per process.
+# Outside DEBUG the loader never re-stats template files, and compiled bytecode is kept on disk.
+templates = Jinja2Templates(
+    directory="app/templates",
+    auto_reload=get_settings().DEBUG,
+    cache_size=-1,
+    bytecode_cache=FileSystemBytecodeCache()
+)
+
+def warm_template_cache():
+    """Compile every template up front instead of on its first request"""
+    for name in templates.env.list_templates():
+        templates.env.get_template(name)
@@ -1,14 +1,58 @@
-from sqlalchemy import create_engine
+import logging
+import time
+
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+from app.core.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
 
-from app.core.config import settings
+# Sync endpoints run on anyio's default 40 worker threads; no worker can use more connections
+SYNC_WORKER_THREADS = 40
 
-engine = create_engine(settings.DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+if settings.DB_USE_NULL_POOL:
+    pool_options = {"poolclass": NullPool}
+else:
+    # Each worker process gets an equal share of the server's connections, after the reserve,
+    # so pool + overflow across all workers stays under max_connections
+    connection_share = (settings.DB_MAX_CONNECTIONS - settings.DB_RESERVED_CONNECTIONS) // max(settings.WORKERS, 1)
+    connection_share = max(1, min(connection_share, SYNC_WORKER_THREADS))
+    pool_size = min(settings.DB_POOL_SIZE, connection_share)
+    pool_options = {
+        "pool_size": pool_size,
+        "max_overflow": connection_share - pool_size,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+        "pool_timeout": settings.DB_POOL_TIMEOUT
+    }
+
+engine = create_engine(
+    settings.DATABASE_URL,
+    # Room for every distinct statement the routers issue, so none get recompiled
+    query_cache_size=1200,
+    **pool_options
+)
+# Objects stay loaded after commit; server defaults are already fetched via RETURNING
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
 
 Base = declarative_base()
 
+if settings.SLOW_QUERY_MS > 0:
+    @event.listens_for(engine, "before_cursor_execute")
+    def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _log_slow_query(conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - conn.info["query_start_time"].pop()) * 1000
+        if elapsed_ms >= settings.SLOW_QUERY_MS:
+            logger.warning("Slow query (%.1f ms): %s", elapsed_ms, statement)
+
 # Dependency function for FastAPI
 def get_db():
     db = SessionLocal()
@@ -1,16 +1,30 @@
-from fastapi import FastAPI, Request, Depends, HTTPException
-from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.templating import Jinja2Templates
+from fastapi import FastAPI, Request
+from fastapi.responses import HTMLResponse, ORJSONResponse, Response
 from fastapi.staticfiles import StaticFiles
-from sqlalchemy.orm import Session
+import logging
+import orjson
+from app.core.templating import templates, warm_template_cache
 from app.routers import admin, payment, auth
-from app.database import SessionLocal
-from app.models.models import *
+from app.utils import dummy_password_hashes
 
-app = FastAPI(title="Wi-Fi Voucher System", description="Production-ready Wi-Fi hotspot with voucher-based access control")
+# Logging is configured once here, for the whole application
+logging.basicConfig(level=logging.INFO)
 
-# Setup templates
-templates = Jinja2Templates(directory="app/templates")
+app = FastAPI(
+    title="Wi-Fi Voucher System",
+    description="Production-ready Wi-Fi hotspot with voucher-based access control",
+    default_response_class=ORJSONResponse
+)
+
+# Compile all templates once at startup
+@app.on_event("startup")
+def load_templates():
+    warm_template_cache()
+
+# Build the dummy password hashes now, so the first unknown-account login isn't slower
+@app.on_event("startup")
+def load_dummy_password_hashes():
+    dummy_password_hashes()
 
 # Mount static files if they exist
 try:
@@ -23,14 +37,6 @@ app.include_router(admin.router, prefix="/admin", tags=["admin"])
 app.include_router(payment.router, prefix="/payment", tags=["payment"])
 app.include_router(auth.router, prefix="/auth", tags=["auth"])
 
-# Dependency
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 # MAIN ENTRY POINTS
 
 @app.get("/", response_class=HTMLResponse)
@@ -97,20 +103,24 @@ async def admin_dashboard_page(request: Request):
 
 # API HEALTH AND INFO
 
+# These bodies never change, so they are serialized once at import
+HEALTH_BODY = orjson.dumps({"status": "healthy", "service": "wifi-voucher-system", "version": "2.0.0"})
+API_INFO_BODY = orjson.dumps({
+    "name": "Wi-Fi Voucher System",
+    "version": "2.0.0", 
+    "description": "Production-ready Wi-Fi access control system",
+    "routes": {
+        "user": ["/user/login", "/user/register", "/user/user-panel", "/user/splash"],
+        "admin": ["/admin/login", "/admin/dashboard"],
+        "auth": ["/auth/*"],
+        "payment": ["/payment/*"]
+    }
+})
+
 @app.get("/health")
-def health_check():
-    return {"status": "healthy", "service": "wifi-voucher-system", "version": "2.0.0"}
+async def health_check():
+    return Response(content=HEALTH_BODY, media_type="application/json")
 
 @app.get("/api/info")
-def api_info():
-    return {
-        "name": "Wi-Fi Voucher System",
-        "version": "2.0.0", 
-        "description": "Production-ready Wi-Fi access control system",
-        "routes": {
-            "user": ["/user/login", "/user/register", "/user/user-panel", "/user/splash"],
-            "admin": ["/admin/login", "/admin/dashboard"],
-            "auth": ["/auth/*"],
-            "payment": ["/payment/*"]
-        }
-    }
+async def api_info():
+    return Response(content=API_INFO_BODY, media_type="application/json")
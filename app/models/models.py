@@ -1,27 +1,37 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, DECIMAL, Text, JSON, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, DECIMAL, Text, JSON, Boolean, Index
 from sqlalchemy.orm import relationship
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, text
 from sqlalchemy.dialects.postgresql import UUID
-import uuid
+import os
 from app.database import Base
 
+# Loader strategy for relationships not eagerly loaded by the query. Set
+# SQLA_DEFAULT_LAZY=raise to make any stray lazy load (an N+1) fail loudly.
+DEFAULT_LAZY = os.getenv("SQLA_DEFAULT_LAZY", "select")
+
+# Fetch server-generated values (ids, timestamps) through RETURNING on
+# INSERT/UPDATE instead of a follow-up SELECT
+MAPPER_ARGS = {"eager_defaults": True}
+
 class Account(Base):
     __tablename__ = "accounts"
+    __mapper_args__ = MAPPER_ARGS
 
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, index=True)
+    id = Column(UUID(as_uuid=True), primary_key=True, server_default=text("gen_random_uuid()"))
     mobile_number = Column(String, unique=True, index=True, nullable=False)
     password_hash = Column(String, nullable=False)
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     last_login = Column(DateTime(timezone=True), nullable=True)
 
-    vouchers = relationship("Voucher", back_populates="owner")
-    transactions = relationship("Transaction", back_populates="account")
+    vouchers = relationship("Voucher", back_populates="owner", lazy=DEFAULT_LAZY)
+    transactions = relationship("Transaction", back_populates="account", lazy=DEFAULT_LAZY)
 
 class Package(Base):
     __tablename__ = "packages"
+    __mapper_args__ = MAPPER_ARGS
     
-    id = Column(String, primary_key=True, index=True)  # e.g., "basic", "premium"
+    id = Column(String, primary_key=True)  # e.g., "basic", "premium"
     name = Column(String, nullable=False)
     description = Column(Text)
     duration = Column(Integer, nullable=False)  # in minutes
@@ -34,8 +44,9 @@ class Package(Base):
 
 class Voucher(Base):
     __tablename__ = "vouchers"
+    __mapper_args__ = MAPPER_ARGS
 
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, index=True)
+    id = Column(UUID(as_uuid=True), primary_key=True, server_default=text("gen_random_uuid()"))
     code = Column(String, unique=True, index=True, nullable=False)
     account_id = Column(UUID(as_uuid=True), ForeignKey("accounts.id"))
     package_id = Column(String, ForeignKey("packages.id"), nullable=True)
@@ -46,13 +57,18 @@ class Voucher(Base):
     expires_at = Column(DateTime(timezone=True))
     used_at = Column(DateTime(timezone=True), nullable=True)
 
-    owner = relationship("Account", back_populates="vouchers")
-    package = relationship("Package")
+    owner = relationship("Account", back_populates="vouchers", lazy=DEFAULT_LAZY)
+    package = relationship("Package", lazy=DEFAULT_LAZY)
+
+    __table_args__ = (
+        Index("ix_vouchers_account_status", "account_id", "status"),
+    )
 
 class Transaction(Base):
     __tablename__ = "transactions"
+    __mapper_args__ = MAPPER_ARGS
     
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, index=True)
+    id = Column(UUID(as_uuid=True), primary_key=True, server_default=text("gen_random_uuid()"))
     account_id = Column(UUID(as_uuid=True), ForeignKey("accounts.id"), nullable=True)
     voucher_id = Column(UUID(as_uuid=True), ForeignKey("vouchers.id"), nullable=True)
     package_id = Column(String, ForeignKey("packages.id"), nullable=True)
@@ -62,5 +78,15 @@ class Transaction(Base):
     transaction_metadata = Column(JSON, nullable=True)  # Store additional payment data as JSON
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
-    account = relationship("Account", back_populates="transactions")
-    package = relationship("Package")
+    account = relationship("Account", back_populates="transactions", lazy=DEFAULT_LAZY)
+    voucher = relationship("Voucher", lazy=DEFAULT_LAZY)
+    package = relationship("Package", lazy=DEFAULT_LAZY)
+
+    __table_args__ = (
+        # Status filters, e.g. the admin dashboard's completed-revenue sum; the leading
+        # status column means it cannot serve an unfiltered ORDER BY created_at
+        Index("ix_transactions_status_created", "status", "created_at"),
+        # The user dashboard's transactions: account_id = ? ORDER BY created_at DESC,
+        # read with a backward index scan
+        Index("ix_transactions_account_created", "account_id", "created_at"),
+    )
@@ -1,13 +1,15 @@
 from fastapi import APIRouter, Depends, HTTPException, Form, Request
-from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.templating import Jinja2Templates
+from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import func, desc
+from sqlalchemy import func, exists, select, update, delete
 from typing import List, Optional
 from decimal import Decimal
-from datetime import datetime, timedelta
+from functools import lru_cache
 
-from app.database import get_db
+from app.cache import active_packages_cache, dashboard_stats_cache
+from app.core.config import get_settings
+from app.core.templating import templates
+from app.database import SessionLocal, get_db
 from app.models.models import Account, Voucher, Transaction, Package
 from app.schemas.schemas import (
     Package as PackageSchema,
@@ -18,19 +20,26 @@ from app.schemas.schemas import (
 )
 from app.routers.auth import get_current_user, create_access_token
 import bcrypt
+import orjson
 
 router = APIRouter(prefix="/admin", tags=["admin"])
-templates = Jinja2Templates(directory="app/templates")
 
 # Simple admin authentication (can be enhanced later)
 ADMIN_USERNAME = "admin"
-ADMIN_PASSWORD_HASH = bcrypt.hashpw("admin123".encode('utf-8'), bcrypt.gensalt())
+
+@lru_cache(maxsize=1)
+def get_admin_password_hash() -> bytes:
+    """Admin password hash from settings, or the default password hashed on first login"""
+    configured_hash = get_settings().ADMIN_PASSWORD_HASH
+    if configured_hash:
+        return configured_hash.encode('utf-8')
+    return bcrypt.hashpw("admin123".encode('utf-8'), bcrypt.gensalt(rounds=10))
 
 def verify_admin(username: str, password: str) -> bool:
     """Verify admin credentials"""
     if username != ADMIN_USERNAME:
         return False
-    return bcrypt.checkpw(password.encode('utf-8'), ADMIN_PASSWORD_HASH)
+    return bcrypt.checkpw(password.encode('utf-8'), get_admin_password_hash())
 
 def get_current_admin(request: Request):
     """Check if user is authenticated admin"""
@@ -50,7 +59,7 @@ async def admin_login_page(request: Request):
 
 # Admin login processing
 @router.post("/login")
-async def admin_login(
+def admin_login(
     request: Request,
     username: str = Form(...),
     password: str = Form(...),
@@ -67,31 +76,45 @@ async def admin_login(
     response.set_cookie(key="admin_token", value="admin_authenticated", httponly=True)
     return response
 
+def get_dashboard_stats(db: Session) -> dict:
+    """Collect the dashboard counters in a single query, cached briefly"""
+    cached = dashboard_stats_cache.get("dashboard")
+    if cached is not None:
+        return cached
+
+    total_accounts = db.query(func.count(Account.id)).scalar_subquery()
+    total_revenue = db.query(func.sum(Transaction.amount)).filter(
+        Transaction.status == "completed"
+    ).scalar_subquery()
+
+    # Voucher counts share one scan of the vouchers table via conditional aggregation
+    stats = db.query(
+        total_accounts.label("total_accounts"),
+        func.count(Voucher.id).label("total_vouchers"),
+        func.count(Voucher.id).filter(Voucher.status == "active").label("active_vouchers"),
+        total_revenue.label("total_revenue")
+    ).select_from(Voucher).one()
+
+    result = {
+        "total_accounts": stats.total_accounts,
+        "total_vouchers": stats.total_vouchers,
+        "active_vouchers": stats.active_vouchers,
+        "total_revenue": stats.total_revenue or Decimal('0')
+    }
+    dashboard_stats_cache.set("dashboard", result)
+    return result
+
 # Admin dashboard
 @router.get("/dashboard", response_class=HTMLResponse)
-async def admin_dashboard(request: Request, db: Session = Depends(get_db), admin=Depends(get_current_admin)):
+def admin_dashboard(request: Request, db: Session = Depends(get_db), admin=Depends(get_current_admin)):
     # Get dashboard statistics
-    total_accounts = db.query(Account).count()
-    total_vouchers = db.query(Voucher).count()
-    active_vouchers = db.query(Voucher).filter(Voucher.status == "active").count()
-    
-    # Calculate total revenue
-    total_revenue = db.query(func.sum(Transaction.amount)).filter(
-        Transaction.status == "completed"
-    ).scalar() or Decimal('0')
-    
-    # Get recent transactions
-    recent_transactions = db.query(Transaction).order_by(desc(Transaction.created_at)).limit(10).all()
+    stats = get_dashboard_stats(db)
     
     # Get all packages
     packages = db.query(Package).order_by(Package.created_at).all()
     
     dashboard_data = {
-        "total_accounts": total_accounts,
-        "total_vouchers": total_vouchers,
-        "active_vouchers": active_vouchers,
-        "total_revenue": total_revenue,
-        "recent_transactions": recent_transactions,
+        **stats,
         "packages": packages
     }
     
@@ -99,71 +122,115 @@ async def admin_dashboard(request: Request, db: Session = Depends(get_db), admin
 
 # Package management endpoints
 @router.get("/packages", response_model=List[PackageSchema])
-async def get_packages(db: Session = Depends(get_db), admin=Depends(get_current_admin)):
+def get_packages(db: Session = Depends(get_db), admin=Depends(get_current_admin)):
     return db.query(Package).all()
 
 @router.post("/packages", response_model=PackageSchema)
-async def create_package(package: PackageCreate, db: Session = Depends(get_db), admin=Depends(get_current_admin)):
+def create_package(package: PackageCreate, db: Session = Depends(get_db), admin=Depends(get_current_admin)):
     # Check if package ID already exists
-    existing = db.query(Package).filter(Package.id == package.id).first()
-    if existing:
+    if db.query(exists().where(Package.id == package.id)).scalar():
         raise HTTPException(status_code=400, detail="Package ID already exists")
     
-    db_package = Package(**package.dict())
+    db_package = Package(**package.model_dump(exclude_unset=True))
     db.add(db_package)
     db.commit()
-    db.refresh(db_package)
+    active_packages_cache.clear()
     return db_package
 
 @router.put("/packages/{package_id}", response_model=PackageSchema)
-async def update_package(
+def update_package(
     package_id: str, 
     package_update: PackageUpdate, 
     db: Session = Depends(get_db), 
     admin=Depends(get_current_admin)
 ):
-    db_package = db.query(Package).filter(Package.id == package_id).first()
+    db_package = db.get(Package, package_id)
     if not db_package:
         raise HTTPException(status_code=404, detail="Package not found")
     
-    update_data = package_update.dict(exclude_unset=True)
+    update_data = package_update.model_dump(exclude_unset=True)
     for field, value in update_data.items():
         setattr(db_package, field, value)
     
-    db_package.updated_at = datetime.utcnow()
+    # updated_at is set by the column's onupdate=func.now()
     db.commit()
-    db.refresh(db_package)
+    active_packages_cache.clear()
     return db_package
 
 @router.delete("/packages/{package_id}")
-async def delete_package(package_id: str, db: Session = Depends(get_db), admin=Depends(get_current_admin)):
-    db_package = db.query(Package).filter(Package.id == package_id).first()
-    if not db_package:
+def delete_package(package_id: str, db: Session = Depends(get_db), admin=Depends(get_current_admin)):
+    # Delete directly and use the row count for the 404, instead of loading the row first
+    result = db.execute(delete(Package).where(Package.id == package_id))
+    if result.rowcount == 0:
         raise HTTPException(status_code=404, detail="Package not found")
     
-    db.delete(db_package)
     db.commit()
+    active_packages_cache.clear()
     return {"message": "Package deleted successfully"}
 
+# Voucher export
+@router.get("/vouchers/export")
+def export_vouchers(admin=Depends(get_current_admin)):
+    """Stream every voucher as newline-delimited JSON"""
+    stmt = select(
+        Voucher.id,
+        Voucher.code,
+        Voucher.account_id,
+        Voucher.package_id,
+        Voucher.duration,
+        Voucher.data_limit,
+        Voucher.status,
+        Voucher.created_at,
+        Voucher.expires_at,
+        Voucher.used_at
+    ).order_by(Voucher.created_at)
+
+    def generate():
+        # The stream outlives the request's dependencies, so it owns its session
+        db = SessionLocal()
+        try:
+            # Fetch in batches so memory stays flat however many vouchers there are
+            for row in db.execute(stmt.execution_options(yield_per=1000)).mappings():
+                yield orjson.dumps(dict(row)) + b"\n"
+        finally:
+            db.close()
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
 # User management endpoints
 @router.get("/users", response_model=List[AccountSchema])
-async def get_users(
+def get_users(
     skip: int = 0, 
     limit: int = 100, 
     db: Session = Depends(get_db), 
     admin=Depends(get_current_admin)
 ):
-    return db.query(Account).offset(skip).limit(limit).all()
+    # Plain column rows serialize straight into the schema, skipping ORM object hydration
+    return db.execute(
+        select(
+            Account.id,
+            Account.mobile_number,
+            Account.is_active,
+            Account.created_at,
+            Account.last_login
+        ).offset(skip).limit(limit)
+    ).all()
 
 @router.put("/users/{user_id}/toggle-active")
-async def toggle_user_active(user_id: str, db: Session = Depends(get_db), admin=Depends(get_current_admin)):
-    user = db.query(Account).filter(Account.id == user_id).first()
-    if not user:
+def toggle_user_active(user_id: str, db: Session = Depends(get_db), admin=Depends(get_current_admin)):
+    # Flip the flag in the database and read the new value back in the same statement.
+    # is_active is nullable with a Python-side default, so NULL counts as active
+    row = db.execute(
+        update(Account)
+        .where(Account.id == user_id)
+        .values(is_active=~func.coalesce(Account.is_active, True))
+        .returning(Account.id, Account.is_active)
+    ).first()
+    if row is None:
         raise HTTPException(status_code=404, detail="User not found")
     
-    user.is_active = not user.is_active
     db.commit()
-    return {"message": f"User {'activated' if user.is_active else 'deactivated'} successfully"}
+    return {"message": f"User {'activated' if row.is_active else 'deactivated'} successfully"}
 
 # Admin logout
 @router.post("/logout")
@@ -1,91 +1,117 @@
-from fastapi import APIRouter, Depends, HTTPException, Request, Form, status
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request, Form, status
 from fastapi.responses import HTMLResponse, RedirectResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy import and_, exists, lambda_stmt, select, update
+from sqlalchemy.orm import Session, joinedload, raiseload
 from datetime import datetime, timedelta, timezone
-from passlib.context import CryptContext
-from jose import JWTError, jwt
-import requests
+import jwt
+from jwt import PyJWTError
+import hashlib
 import logging
 import re
+import time
 import uuid
 
 from app import schemas
-from app.database import get_db
+from app.database import SessionLocal, get_db
 from app.models.models import Account, Voucher, Transaction, Package
-from app.core.config import settings
+from app.core.config import Settings, get_settings
 from app import utils
-from fastapi.templating import Jinja2Templates
+from app.utils import ALGORITHM, create_access_token, hash_password as get_password_hash
+from app.cache import token_account_cache, voucher_validation_cache
+from app.core.templating import templates
 
-templates = Jinja2Templates(directory="app/templates")
-
-# Set up logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 # OAuth2 scheme
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token")
 
 # JWT settings
-SECRET_KEY = getattr(settings, 'SECRET_KEY', "your-secret-key-here")
-ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 router = APIRouter()
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
-def get_password_hash(password):
-    # Ensure password doesn't exceed bcrypt's 72-byte limit
-    password_bytes = password.encode('utf-8')
-    if len(password_bytes) > 72:
-        password_bytes = password_bytes[:72]
-        password = password_bytes.decode('utf-8', errors='replace')
-    return pwd_context.hash(password)
-
-def create_access_token(data: dict, expires_delta: timedelta = None):
-    to_encode = data.copy()
-    if expires_delta:
-        expire = datetime.utcnow() + expires_delta
-    else:
-        expire = datetime.utcnow() + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
-
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+# Colon- or dash-separated MAC address, e.g. AA:BB:CC:DD:EE:FF
+MAC_ADDRESS_RE = re.compile(r'(?:[0-9A-Fa-f]{2}[:-]){5}[0-9A-Fa-f]{2}')
+
+# Headers that may carry the client MAC, checked in order
+MAC_HEADERS = ('X-Forwarded-For', 'X-Real-IP', 'X-Client-MAC', 'Remote-Addr', 'HTTP_CLIENT_MAC')
+
+# Formatting characters stripped from mobile numbers at login (whitespace is split out first)
+MOBILE_STRIP_TABLE = str.maketrans('', '', '-()')
+
+def get_account_by_mobile(db: Session, mobile_number: str):
+    # Runs on every authenticated request; the lambda keeps its compiled SQL cached
+    stmt = lambda_stmt(lambda: select(Account).where(Account.mobile_number == mobile_number))
+    return db.execute(stmt).scalars().first()
+
+def get_current_user(
+    token: str = Depends(oauth2_scheme),
+    db: Session = Depends(get_db),
+    settings: Settings = Depends(get_settings)
+):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    # A token seen recently skips signature verification and resolves by primary key
+    token_key = hashlib.blake2b(token.encode(), digest_size=16).digest()
+    cached = token_account_cache.get(token_key)
+    if cached is not None:
+        account_id, expires_at = cached
+        if expires_at > time.time():
+            user = db.get(Account, account_id)
+            if user is not None:
+                return user
+        token_account_cache.pop(token_key)
+
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        # exp is required: it bounds how long the token stays in token_account_cache
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[ALGORITHM], options={"require": ["exp"]})
         mobile_number: str = payload.get("sub")
         if mobile_number is None:
             raise credentials_exception
-    except JWTError:
+    except PyJWTError:
         raise credentials_exception
     
-    user = db.query(Account).filter(Account.mobile_number == mobile_number).first()
+    user = get_account_by_mobile(db, mobile_number)
     if user is None:
         raise credentials_exception
+    token_account_cache.set(token_key, (user.id, payload["exp"]))
     return user
 
 def utc_now():
     """Get current UTC time with timezone info"""
     return datetime.now(timezone.utc)
 
+def record_last_login(account_id):
+    """Stamp last_login in its own session, run as a background task after the response"""
+    db = SessionLocal()
+    try:
+        db.execute(update(Account).where(Account.id == account_id).values(last_login=utc_now()))
+        db.commit()
+    except Exception as e:
+        logger.error("Failed to record last login for %s: %s", account_id, e)
+    finally:
+        db.close()
+
 def authenticate_user(db: Session, mobile_number: str, password: str):
-    user = db.query(Account).filter(Account.mobile_number == mobile_number).first()
+    user = get_account_by_mobile(db, mobile_number)
+    # End the read transaction so the connection goes back to the pool while the
+    # password check waits for a hashing slot
+    db.commit()
     if not user:
+        # Spend a hash verification anyway so response time doesn't reveal missing accounts
+        utils.dummy_verify_password()
         return False
-    if not verify_password(password, user.password_hash):
+    valid, new_hash = utils.verify_and_update_password(password, user.password_hash)
+    if not valid:
         return False
+    if new_hash:
+        # Hash was made with a legacy scheme or cost; upgrade it while the plaintext is at hand
+        user.password_hash = new_hash
+        db.commit()
     return user
 
 def get_client_mac_from_request(request: Request):
@@ -93,24 +119,16 @@ def get_client_mac_from_request(request: Request):
     Extract client MAC address from various possible sources
     """
     # Try different headers where MAC might be present
-    possible_headers = [
-        'X-Forwarded-For',
-        'X-Real-IP', 
-        'X-Client-MAC',
-        'Remote-Addr',
-        'HTTP_CLIENT_MAC'
-    ]
-    
-    for header in possible_headers:
+    for header in MAC_HEADERS:
         value = request.headers.get(header)
         if value:
             # Simple MAC address pattern check
-            if re.match(r'^([0-9A-Fa-f]{2}[:-]){5}([0-9A-Fa-f]{2})$', value):
+            if MAC_ADDRESS_RE.fullmatch(value):
                 return value
     
     # Try query parameters
     client_mac = request.query_params.get('client_mac')
-    if client_mac and re.match(r'^([0-9A-Fa-f]{2}[:-]){5}([0-9A-Fa-f]{2})$', client_mac):
+    if client_mac and MAC_ADDRESS_RE.fullmatch(client_mac):
         return client_mac
     
     return None
@@ -121,9 +139,10 @@ def register_user(user: schemas.AccountCreate, db: Session = Depends(get_db)):
     """Register a new user with mobile number and password"""
     
     # Check if user already exists
-    db_user = db.query(Account).filter(Account.mobile_number == user.mobile_number).first()
-    if db_user:
+    if db.query(exists().where(Account.mobile_number == user.mobile_number)).scalar():
         raise HTTPException(status_code=400, detail="Mobile number already registered")
+    # Release the connection before hashing waits for a slot
+    db.commit()
     
     # Create new user
     hashed_password = get_password_hash(user.password)
@@ -133,24 +152,28 @@ def register_user(user: schemas.AccountCreate, db: Session = Depends(get_db)):
     )
     db.add(db_user)
     db.commit()
-    db.refresh(db_user)
     
     return db_user
 
 @router.post("/token")
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+def login_for_access_token(
+    background_tasks: BackgroundTasks,
+    form_data: OAuth2PasswordRequestForm = Depends(),
+    db: Session = Depends(get_db)
+):
     """Authenticate user and return access token"""
     try:
         # Normalize the mobile number format
         mobile_number = form_data.username
         
         # Log the original input for debugging
-        logger.info(f"Login attempt for: {mobile_number}")
+        logger.info("Login attempt for: %s", mobile_number)
         
         # Better mobile number normalization
         if mobile_number:
             # Strip any whitespace or formatting characters
-            mobile_number = re.sub(r'[\s\-()]', '', mobile_number)
+            # split() drops all Unicode whitespace, such as the NBSP in pasted numbers
+            mobile_number = ''.join(mobile_number.split()).translate(MOBILE_STRIP_TABLE)
             
             # Handle different formats
             if mobile_number.startswith('+'):
@@ -161,38 +184,50 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
             elif len(mobile_number) == 9:  # Just the 9 digits
                 mobile_number = f"255{mobile_number}"
         
-        logger.info(f"Normalized mobile number: {mobile_number}")
+        logger.info("Normalized mobile number: %s", mobile_number)
         
-        # Find the user first
-        user = db.query(Account).filter(Account.mobile_number == mobile_number).first()
+        # Find the user first; only the columns needed to log in, no ORM object
+        user = db.query(
+            Account.id, Account.mobile_number, Account.password_hash
+        ).filter(Account.mobile_number == mobile_number).first()
+        # Release the connection before the password check waits for a hashing slot
+        db.commit()
         
         if not user:
-            logger.warning(f"No user found with mobile number: {mobile_number}")
+            logger.warning("No user found with mobile number: %s", mobile_number)
+            utils.dummy_verify_password()
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="User not found with this mobile number",
+                detail="Incorrect mobile number or password",
                 headers={"WWW-Authenticate": "Bearer"},
             )
         
-        # Verify password
-        if not verify_password(form_data.password, user.password_hash):
-            logger.warning(f"Invalid password for user: {mobile_number}")
+        # Verify password, upgrading the stored hash if its scheme or cost is outdated
+        valid, new_hash = utils.verify_and_update_password(form_data.password, user.password_hash)
+        if not valid:
+            logger.warning("Invalid password for user: %s", mobile_number)
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Incorrect password",
+                detail="Incorrect mobile number or password",
                 headers={"WWW-Authenticate": "Bearer"},
             )
         
+        if new_hash:
+            db.execute(update(Account).where(Account.id == user.id).values(password_hash=new_hash))
+            db.commit()
+        
         # User authenticated, generate token
-        logger.info(f"User authenticated successfully: {mobile_number}")
+        logger.info("User authenticated successfully: %s", mobile_number)
         access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
         access_token = create_access_token(
             data={"sub": user.mobile_number}, expires_delta=access_token_expires
         )
         
-        # Update last login
-        user.last_login = utc_now()
-        db.commit()
+        # get_db only closes after background tasks finish; close now so the request's
+        # session holds no connection while record_last_login checks out its own
+        db.close()
+        # Update last login once the response has been sent
+        background_tasks.add_task(record_last_login, user.id)
         
         return {
             "access_token": access_token, 
@@ -205,10 +240,8 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
         # Re-raise HTTP exceptions directly
         raise he
     except Exception as e:
-        # Log the full exception information
-        logger.error(f"Token generation error: {str(e)}")
-        import traceback
-        logger.error(traceback.format_exc())
+        # The traceback is only formatted if a handler accepts the record
+        logger.exception("Token generation error: %s", e)
         
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -223,7 +256,7 @@ async def read_users_me(current_user: Account = Depends(get_current_user)):
 
 # User authentication endpoints
 @router.post("/user/login")
-async def user_login(login_data: schemas.AccountLogin, db: Session = Depends(get_db)):
+def user_login(login_data: schemas.AccountLogin, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
     """Authenticate user with mobile number and password"""
     user = authenticate_user(db, login_data.mobile_number, login_data.password)
     if not user:
@@ -239,83 +272,97 @@ async def user_login(login_data: schemas.AccountLogin, db: Session = Depends(get
         expires_delta=access_token_expires
     )
     
-    # Update last login
-    user.last_login = utc_now()
-    db.commit()
+    # Serialize through the public schema so password_hash never leaves the server
+    account = schemas.Account.model_validate(user)
+    
+    # get_db only closes after background tasks finish; close now so the request's
+    # session holds no connection while record_last_login checks out its own
+    db.close()
+    # Update last login once the response has been sent
+    background_tasks.add_task(record_last_login, user.id)
     
     return {
         "access_token": access_token,
         "token_type": "bearer",
-        "user": user
+        "user": account
     }
 
 
 
 
+# Fixed responses for the invalid-voucher paths, built once instead of per request
+ACCOUNT_NOT_FOUND = schemas.VoucherValidationResponse(valid=False, message="Account not found.")
+VOUCHER_NOT_FOUND = schemas.VoucherValidationResponse(valid=False, message="Voucher not found for this account.")
+VOUCHER_ALREADY_USED = schemas.VoucherValidationResponse(valid=False, message="Voucher has already been used.")
+VOUCHER_EXPIRED = schemas.VoucherValidationResponse(valid=False, message="Voucher has expired.")
+VALIDATION_ERROR = schemas.VoucherValidationResponse(valid=False, message="An error occurred while validating the voucher.")
+
+def valid_voucher_response(expires_at, data_limit, now):
+    time_remaining = None
+    if expires_at:
+        time_remaining = int((expires_at - now).total_seconds() / 60)  # in minutes
+
+    return schemas.VoucherValidationResponse(
+        valid=True,
+        message="Voucher is valid and ready to use.",
+        duration_remaining=time_remaining,
+        data_remaining=data_limit
+    )
+
 @router.post("/validate", response_model=schemas.VoucherValidationResponse)
 def validate_voucher(validation_data: schemas.VoucherValidation, db: Session = Depends(get_db)):
     """
     Validate a voucher without consuming it. Useful for checking status.
     """
     try:
-        # Find the account by mobile number
-        account = db.query(Account).filter(Account.mobile_number == validation_data.mobile_number).first()
-        if not account:
-            return schemas.VoucherValidationResponse(
-                valid=False,
-                message="Account not found."
-            )
-
-        # Find the voucher
-        voucher = db.query(Voucher).filter(
-            Voucher.code == validation_data.voucher_code,
-            Voucher.account_id == account.id
+        # One timestamp for every expiry check in this request
+        now = utc_now()
+
+        # Repeated polls for a voucher already known to be valid skip the database
+        cache_key = (validation_data.mobile_number, validation_data.voucher_code)
+        cached = voucher_validation_cache.get(cache_key)
+        if cached is not None:
+            expires_at, data_limit = cached
+            if expires_at is None or expires_at > now:
+                return valid_voucher_response(expires_at, data_limit, now)
+            voucher_validation_cache.pop(cache_key)
+
+        # Look up the account and its matching voucher together; the outer join
+        # still returns the account row when the voucher doesn't match
+        row = db.execute(
+            select(Account.id, Voucher)
+            .outerjoin(Voucher, and_(
+                Voucher.account_id == Account.id,
+                Voucher.code == validation_data.voucher_code
+            ))
+            .where(Account.mobile_number == validation_data.mobile_number)
+            .options(raiseload("*"))
         ).first()
+        if row is None:
+            return ACCOUNT_NOT_FOUND
 
+        voucher = row.Voucher
         if not voucher:
-            return schemas.VoucherValidationResponse(
-                valid=False,
-                message="Voucher not found for this account."
-            )
+            return VOUCHER_NOT_FOUND
 
         # Check voucher status and expiry
         if voucher.status == "used":
-            return schemas.VoucherValidationResponse(
-                valid=False,
-                message="Voucher has already been used."
-            )
+            return VOUCHER_ALREADY_USED
         elif voucher.status == "expired":
-            return schemas.VoucherValidationResponse(
-                valid=False,
-                message="Voucher has expired."
-            )
-        elif voucher.expires_at and voucher.expires_at < utc_now():
+            return VOUCHER_EXPIRED
+        elif voucher.expires_at and voucher.expires_at < now:
             # Mark as expired
             voucher.status = "expired"
             db.commit()
-            return schemas.VoucherValidationResponse(
-                valid=False,
-                message="Voucher has expired."
-            )
+            return VOUCHER_EXPIRED
 
         # Voucher is valid
-        time_remaining = None
-        if voucher.expires_at:
-            time_remaining = int((voucher.expires_at - utc_now()).total_seconds() / 60)  # in minutes
-
-        return schemas.VoucherValidationResponse(
-            valid=True,
-            message="Voucher is valid and ready to use.",
-            duration_remaining=time_remaining,
-            data_remaining=voucher.data_limit
-        )
+        voucher_validation_cache.set(cache_key, (voucher.expires_at, voucher.data_limit))
+        return valid_voucher_response(voucher.expires_at, voucher.data_limit, now)
 
     except Exception as e:
-        logger.error(f"Error validating voucher: {str(e)}")
-        return schemas.VoucherValidationResponse(
-            valid=False,
-            message="An error occurred while validating the voucher."
-        )
+        logger.error("Error validating voucher: %s", e)
+        return VALIDATION_ERROR
 
 @router.post("/demo-voucher")
 def create_demo_voucher(mobile_number: str, db: Session = Depends(get_db)):
@@ -323,60 +370,54 @@ def create_demo_voucher(mobile_number: str, db: Session = Depends(get_db)):
     Create a 10-minute demo voucher for testing purposes.
     """
     try:
-        from app import utils
-        
         # Check if account exists, if not create one
         account = db.query(Account).filter(Account.mobile_number == mobile_number).first()
         if not account:
             account = Account(mobile_number=mobile_number)
-            db.add(account)
-            db.commit()
-            db.refresh(account)
-
-        # Generate unique voucher code
-        while True:
-            code = utils.generate_voucher_code()
-            if not db.query(Voucher).filter(Voucher.code == code).first():
-                break
 
-        # Create demo voucher (10 minutes)
+        # Create demo voucher (10 minutes); a new account is inserted in the same commit
         voucher = Voucher(
-            code=code,
-            account_id=account.id,
+            owner=account,
             duration=10,  # 10 minutes
             status="active",
             expires_at=utc_now() + timedelta(minutes=60)  # Valid for 1 hour to be claimed
         )
-        db.add(voucher)
+        utils.insert_voucher(db, voucher)
         db.commit()
-        db.refresh(voucher)
 
         return {
             "success": True,
             "message": "Demo voucher created successfully!",
-            "voucher_code": code,
+            "voucher_code": voucher.code,
             "duration": "10 minutes",
             "expires_at": voucher.expires_at.isoformat()
         }
 
     except Exception as e:
-        logger.error(f"Error creating demo voucher: {str(e)}")
+        logger.error("Error creating demo voucher: %s", e)
         raise HTTPException(status_code=500, detail="Failed to create demo voucher")
 
 # NEW USER DASHBOARD ENDPOINTS
 
 @router.get("/panel", response_model=schemas.UserDashboard)
-async def user_dashboard(current_user: Account = Depends(get_current_user), db: Session = Depends(get_db)):
+def user_dashboard(current_user: Account = Depends(get_current_user), db: Session = Depends(get_db)):
     """Get user dashboard data with vouchers, transactions, and available packages"""
     try:
-        # Get user's vouchers
-        vouchers = db.query(Voucher).filter(Voucher.account_id == current_user.id).order_by(Voucher.created_at.desc()).all()
+        # Get user's vouchers (packages are eager-loaded for the response schema;
+        # any other relationship access raises instead of lazy loading per row)
+        vouchers = db.query(Voucher).options(
+            joinedload(Voucher.package),
+            raiseload("*")
+        ).filter(Voucher.account_id == current_user.id).order_by(Voucher.created_at.desc()).all()
         
         # Get user's transactions  
-        transactions = db.query(Transaction).filter(Transaction.account_id == current_user.id).order_by(Transaction.created_at.desc()).all()
+        transactions = db.query(Transaction).options(
+            joinedload(Transaction.package),
+            raiseload("*")
+        ).filter(Transaction.account_id == current_user.id).order_by(Transaction.created_at.desc()).all()
         
         # Get available packages
-        packages = db.query(Package).filter(Package.is_active == True).all()
+        packages = utils.get_active_packages(db)
         
         return schemas.UserDashboard(
             account=current_user,
@@ -385,9 +426,7 @@ async def user_dashboard(current_user: Account = Depends(get_current_user), db:
             available_packages=packages
         )
     except Exception as e:
-        logger.error(f"Error fetching user dashboard: {str(e)}")
-        import traceback
-        logger.error(traceback.format_exc())
+        logger.exception("Error fetching user dashboard: %s", e)
         raise HTTPException(status_code=500, detail="Failed to fetch dashboard data")
 
 @router.get("/user/panel", response_class=HTMLResponse)
@@ -397,14 +436,14 @@ async def user_panel(request: Request):
 
 
 @router.post("/user/purchase-package")
-async def purchase_package(
+def purchase_package(
     package_id: str = Form(...),
     current_user: Account = Depends(get_current_user), 
     db: Session = Depends(get_db)
 ):
     """Initiate package purchase process"""
     # Get package details
-    package = db.query(Package).filter(Package.id == package_id).first()
+    package = db.get(Package, package_id)
     if not package:
         raise HTTPException(status_code=404, detail="Package not found")
     
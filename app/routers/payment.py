@@ -1,21 +1,38 @@
-from fastapi import APIRouter, Depends, HTTPException, Request, Header
+from fastapi import APIRouter, Body, Depends, HTTPException, Header
 from sqlalchemy.orm import Session
 from datetime import datetime, timedelta
 from decimal import Decimal
+import base64
 import json
 import hashlib
 import hmac
 import uuid
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from typing import Optional
 
 from app import schemas, utils
-from app.core.config import settings
+from app.core.config import Settings, get_settings
 from app.database import get_db
 from app.models.models import Account, Voucher, Transaction, Package
 
 router = APIRouter()
 
+# M-Pesa Daraja endpoints
+MPESA_STK_PUSH_URL = "https://sandbox-api.safaricom.co.ke/mpesa/stkpush/v1/processrequest"
+MPESA_OAUTH_URL = "https://sandbox-api.safaricom.co.ke/oauth/v1/generate?grant_type=client_credentials"
+
+# One keep-alive session for all Daraja calls, so requests reuse TLS connections.
+# Retry covers idempotent calls only (the token GET); STK push POSTs are never replayed.
+mpesa_http = requests.Session()
+mpesa_http.headers.update({"Content-Type": "application/json"})
+mpesa_http.mount("https://", HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=50,
+    max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=[429, 502, 503, 504])
+))
+
 @router.post("/create-payment-intent")
 def create_payment_intent(payment_intent_in: schemas.PaymentIntentCreate, db: Session = Depends(get_db)):
     """
@@ -24,7 +41,7 @@ def create_payment_intent(payment_intent_in: schemas.PaymentIntentCreate, db: Se
     """
     try:
         # Get package details
-        package = db.query(Package).filter(Package.id == payment_intent_in.package_id).first()
+        package = db.get(Package, payment_intent_in.package_id)
         if not package:
             raise HTTPException(status_code=404, detail="Package not found")
         
@@ -72,7 +89,11 @@ def create_payment_intent(payment_intent_in: schemas.PaymentIntentCreate, db: Se
         raise HTTPException(status_code=400, detail=str(e))
 
 @router.post("/mpesa/initiate")
-def initiate_mpesa_payment(payment_data: schemas.MPesaPaymentRequest, db: Session = Depends(get_db)):
+def initiate_mpesa_payment(
+    payment_data: schemas.MPesaPaymentRequest,
+    db: Session = Depends(get_db),
+    settings: Settings = Depends(get_settings)
+):
     """
     Initiate M-Pesa STK Push payment.
     """
@@ -105,13 +126,10 @@ def initiate_mpesa_payment(payment_data: schemas.MPesaPaymentRequest, db: Sessio
         }
 
         # Make STK Push request
-        headers = {
-            "Authorization": f"Bearer {access_token}",
-            "Content-Type": "application/json"
-        }
+        headers = {"Authorization": f"Bearer {access_token}"}
 
-        response = requests.post(
-            "https://sandbox-api.safaricom.co.ke/mpesa/stkpush/v1/processrequest",
+        response = mpesa_http.post(
+            MPESA_STK_PUSH_URL,
             json=stk_payload,
             headers=headers,
             timeout=30
@@ -154,13 +172,11 @@ def initiate_mpesa_payment(payment_data: schemas.MPesaPaymentRequest, db: Sessio
         raise HTTPException(status_code=500, detail=f"M-Pesa payment error: {str(e)}")
 
 @router.post("/mpesa/callback")
-async def mpesa_callback(request: Request, db: Session = Depends(get_db)):
+def mpesa_callback(payload: dict = Body(...), db: Session = Depends(get_db)):
     """
     Handle M-Pesa payment callbacks.
     """
     try:
-        payload = await request.json()
-
         # Extract callback data
         stk_callback = payload.get("Body", {}).get("stkCallback", {})
         result_code = stk_callback.get("ResultCode")
@@ -183,7 +199,7 @@ async def mpesa_callback(request: Request, db: Session = Depends(get_db)):
             package_id = metadata.get("package_id")
             
             # Get package details
-            package = db.query(Package).filter(Package.id == package_id).first()
+            package = db.get(Package, package_id)
             if not package:
                 transaction.status = "failed"
                 db.commit()
@@ -193,36 +209,23 @@ async def mpesa_callback(request: Request, db: Session = Depends(get_db)):
             account = db.query(Account).filter(Account.mobile_number == mobile_number).first()
             if not account:
                 # Create account with a default password (user should change it later)
-                from app.routers.auth import get_password_hash
-                hashed_password = get_password_hash("changeme123")  # Default password
+                hashed_password = utils.hash_password("changeme123")  # Default password
                 account = Account(mobile_number=mobile_number, password_hash=hashed_password)
-                db.add(account)
-                db.commit()
-                db.refresh(account)
-
-            # Generate unique voucher code
-            while True:
-                code = utils.generate_voucher_code()
-                if not db.query(Voucher).filter(Voucher.code == code).first():
-                    break
 
             # Create voucher with package details
             voucher = Voucher(
-                code=code,
-                account_id=account.id,
+                owner=account,
                 package_id=package.id,
                 duration=package.duration,
                 data_limit=package.data_limit,
                 status="active"
             )
-            db.add(voucher)
-            db.commit()
-            db.refresh(voucher)
 
-            # Update transaction
+            # Account, voucher and transaction update are written in one commit
             transaction.status = "completed"
-            transaction.account_id = account.id
-            transaction.voucher_id = voucher.id
+            utils.insert_voucher(db, voucher)
+            transaction.account = account
+            transaction.voucher = voucher
             db.commit()
 
             # Send voucher via SMS or email if available
@@ -278,7 +281,7 @@ def process_dummy_payment(payment_data: schemas.DummyPaymentRequest, db: Session
         amount = payment_data.amount
         
         # Get package details
-        package = db.query(Package).filter(Package.id == package_id).first()
+        package = db.get(Package, package_id)
         if not package:
             raise HTTPException(status_code=404, detail="Package not found")
         
@@ -289,36 +292,24 @@ def process_dummy_payment(payment_data: schemas.DummyPaymentRequest, db: Session
         account = db.query(Account).filter(Account.mobile_number == mobile_number).first()
         if not account:
             # Create account with a default password (user should change it later)
-            from app.routers.auth import get_password_hash
-            hashed_password = get_password_hash("changeme123")  # Default password
+            hashed_password = utils.hash_password("changeme123")  # Default password
             account = Account(mobile_number=mobile_number, password_hash=hashed_password)
-            db.add(account)
-            db.commit()
-            db.refresh(account)
-
-        # Generate unique voucher code
-        while True:
-            code = utils.generate_voucher_code()
-            if not db.query(Voucher).filter(Voucher.code == code).first():
-                break
 
         # Create voucher with package details
         voucher = Voucher(
-            code=code,
-            account_id=account.id,
+            owner=account,
             package_id=package.id,
             duration=package.duration,
             data_limit=package.data_limit,
             status="active"
         )
-        db.add(voucher)
-        db.commit()
-        db.refresh(voucher)
 
-        # Create transaction record
+        utils.insert_voucher(db, voucher)
+
+        # Create transaction record; account, voucher and transaction share one commit
         transaction = Transaction(
-            account_id=account.id,
-            voucher_id=voucher.id,
+            account=account,
+            voucher=voucher,
             package_id=package.id,
             amount=Decimal(amount),
             payment_method="dummy",
@@ -350,7 +341,7 @@ def get_voucher_plans(db: Session = Depends(get_db)):
     """
     Get available voucher plans from database packages.
     """
-    packages = db.query(Package).filter(Package.is_active == True).order_by(Package.price).all()
+    packages = utils.get_active_packages(db)
     
     plans = []
     for package in packages:
@@ -375,7 +366,8 @@ def create_demo_voucher(mobile_number: str, db: Session = Depends(get_db)):
     # Check if user already has an active demo voucher
     account = db.query(Account).filter(Account.mobile_number == mobile_number).first()
     if account:
-        existing_demo = db.query(Voucher).filter(
+        # Only the code is needed, so skip loading the full voucher
+        existing_demo = db.query(Voucher.code).filter(
             Voucher.account_id == account.id,
             Voucher.duration == 10,  # Demo vouchers are 10 minutes
             Voucher.status == "active"
@@ -388,41 +380,30 @@ def create_demo_voucher(mobile_number: str, db: Session = Depends(get_db)):
             }
     else:
         # Create account with default password
-        from app.routers.auth import get_password_hash
-        hashed_password = get_password_hash("demo123")  # Default demo password
+        hashed_password = utils.hash_password("demo123")  # Default demo password
         account = Account(mobile_number=mobile_number, password_hash=hashed_password)
-        db.add(account)
-        db.commit()
-        db.refresh(account)
-
-    # Generate a unique voucher code
-    while True:
-        code = utils.generate_voucher_code()
-        if not db.query(Voucher).filter(Voucher.code == code).first():
-            break
 
     # Create demo voucher
     db_voucher = Voucher(
-        code=code,
-        account_id=account.id,
+        owner=account,
         duration=10,  # 10 minutes
         data_limit=None,
         status="active"
     )
-    db.add(db_voucher)
-    db.commit()
-    db.refresh(db_voucher)
 
-    # Create transaction record for the free voucher
+    utils.insert_voucher(db, db_voucher)
+
+    # Create transaction record for the free voucher; everything is written in one commit
     transaction = Transaction(
-        account_id=account.id,
-        voucher_id=db_voucher.id,
+        account=account,
+        voucher=db_voucher,
         amount=Decimal('0.00'),
         payment_method="demo",
         status="completed"
     )
     db.add(transaction)
     db.commit()
+    code = db_voucher.code
 
     # For now, just log the voucher creation (you can integrate SMS service later)
     print(f"Demo voucher created for {mobile_number}: {code}")
@@ -454,6 +435,7 @@ def get_transaction_status(transaction_id: int, db: Session = Depends(get_db)):
 # M-Pesa helper functions
 def get_mpesa_access_token():
     """Get M-Pesa access token."""
+    settings = get_settings()
     try:
         consumer_key = getattr(settings, 'MPESA_CONSUMER_KEY', '')
         consumer_secret = getattr(settings, 'MPESA_CONSUMER_SECRET', '')
@@ -461,12 +443,9 @@ def get_mpesa_access_token():
         if not consumer_key or not consumer_secret:
             return None
 
-        api_url = "https://sandbox-api.safaricom.co.ke/oauth/v1/generate?grant_type=client_credentials"
-
-        response = requests.get(
-            api_url,
+        response = mpesa_http.get(
+            MPESA_OAUTH_URL,
             auth=(consumer_key, consumer_secret),
-            headers={'Content-Type': 'application/json'},
             timeout=30
         )
 
@@ -480,6 +459,7 @@ def get_mpesa_access_token():
 
 def generate_mpesa_password(timestamp):
     """Generate M-Pesa password."""
+    settings = get_settings()
     try:
         shortcode = getattr(settings, 'MPESA_SHORTCODE', '')
         passkey = getattr(settings, 'MPESA_PASSKEY', '')
@@ -487,7 +467,6 @@ def generate_mpesa_password(timestamp):
         password_str = shortcode + passkey + timestamp
         password = hashlib.sha256(password_str.encode()).hexdigest()
 
-        import base64
         return base64.b64encode(password.encode()).decode()
 
     except Exception as e:
@@ -2,14 +2,17 @@ from pydantic import BaseModel, validator, Field
 from datetime import datetime
 from typing import Optional
 from decimal import Decimal
-import re
 import uuid
 
+# Hyphens and plus signs removed before validating a mobile number (whitespace is split out first)
+MOBILE_CLEAN_TABLE = str.maketrans('', '', '-+')
+
 # Tanzanian mobile number validation
 def validate_tz_mobile(mobile_number: str) -> str:
     """Validate Tanzanian mobile number format"""
     # Remove any spaces, hyphens, or plus signs
-    cleaned = re.sub(r'[\s\-\+]', '', mobile_number)
+    # split() drops all Unicode whitespace, such as the NBSP in pasted numbers
+    cleaned = ''.join(mobile_number.split()).translate(MOBILE_CLEAN_TABLE)
     
     # Check if it starts with country code (255) or local format (0)
     if cleaned.startswith('255'):
@@ -85,6 +88,8 @@ class PackageUpdate(BaseModel):
 
 class Package(PackageBase):
     id: str
+    # Stored packages may be free (the seeded "demo" package costs 0), so no gt=0 on read
+    price: Decimal
     is_active: bool
     created_at: datetime
     updated_at: datetime
@@ -1,17 +1,40 @@
-import random
+import secrets
 import string
+import threading
+import time
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from passlib.context import CryptContext
-from jose import JWTError, jwt
-from datetime import datetime, timedelta
+import jwt
+from jwt import PyJWTError
+from datetime import timedelta
+from functools import lru_cache
 from typing import Optional
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
 
-from app.core.config import settings
+from app import schemas
+from app.cache import active_packages_cache
+from app.core.config import get_settings
+from app.models.models import Package, Voucher
 
-# Password hashing context
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Password hashing context: new hashes are Argon2id (OWASP parameters); legacy
+# bcrypt hashes still verify and are rehashed by verify_and_update on login
+pwd_context = CryptContext(
+    schemes=["argon2", "bcrypt"],
+    argon2__time_cost=2,
+    argon2__memory_cost=19456,
+    argon2__parallelism=1,
+    deprecated="auto"
+)
+
+# Each Argon2 hash or verify holds ~19 MiB and a full core; cap how many run at once
+# per worker so a login burst can't take every thread and a gigabyte of memory
+password_hash_slots = threading.BoundedSemaphore(get_settings().PASSWORD_HASH_CONCURRENCY)
+
+# JWT signing algorithm
+ALGORITHM = "HS256"
 
 def generate_voucher_code(length: int = 10) -> str:
     """
@@ -19,43 +42,115 @@ def generate_voucher_code(length: int = 10) -> str:
     Uses uppercase letters and digits for better readability and security.
     Excludes confusing characters like 0, O, 1, I, L to prevent errors.
     """
-    # Use clear characters only - exclude 0, O, 1, I, L for better readability
+    # Use clear characters only - exclude 0, O, 1, I, L for better readability.
+    # 31^10 codes (~49 bits) from the OS CSPRNG, so collisions are rare and codes unguessable
     clear_chars = 'ABCDEFGHJKMNPQRSTUVWXYZ23456789'
-    return ''.join(random.choices(clear_chars, k=length))
+    return ''.join(secrets.choice(clear_chars) for _ in range(length))
+
+# Unique constraint on vouchers.code: Postgres' default name for the migration's unnamed
+# UniqueConstraint, or the unique index metadata.create_all builds from unique=True, index=True
+VOUCHER_CODE_CONSTRAINTS = {"vouchers_code_key", "ix_vouchers_code"}
+
+def insert_voucher(db: Session, voucher: Voucher, max_attempts: int = 5) -> Voucher:
+    """
+    Insert a voucher with a freshly generated code; the caller commits.
+    Uniqueness is left to the unique index on vouchers.code rather than
+    probed up front. The insert runs under a SAVEPOINT, so a collision
+    rolls back only the voucher (and a new owner account) and is retried
+    with a new code. Attach the voucher or its owner to other session
+    objects, such as a transaction, only after this returns; otherwise
+    cascades put it in the session and it is flushed outside the SAVEPOINT.
+    """
+    if voucher in db:
+        raise ValueError("Voucher is already in the session; link it to other objects after insert_voucher")
+    for _ in range(max_attempts):
+        voucher.code = generate_voucher_code()
+        try:
+            with db.begin_nested():
+                db.add(voucher)
+            return voucher
+        except IntegrityError as e:
+            constraint = getattr(getattr(e.orig, "diag", None), "constraint_name", None)
+            if constraint not in VOUCHER_CODE_CONSTRAINTS:
+                raise
+    raise RuntimeError("Could not generate a unique voucher code")
+
+def get_active_packages(db: Session) -> list[schemas.Package]:
+    """
+    Active packages ordered by price, served from a short-lived cache.
+    Cached as schema objects so they can be shared across sessions.
+    """
+    packages = active_packages_cache.get("active")
+    if packages is None:
+        rows = db.query(Package).filter(Package.is_active == True).order_by(Package.price).all()
+        packages = [schemas.Package.model_validate(p) for p in rows]
+        active_packages_cache.set("active", packages)
+    return packages
 
 def hash_password(password: str) -> str:
-    """Hash a password using bcrypt."""
-    return pwd_context.hash(password)
+    """Hash a password using Argon2id."""
+    with password_hash_slots:
+        return pwd_context.hash(password)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a password against its hash."""
-    return pwd_context.verify(plain_password, hashed_password)
+    with password_hash_slots:
+        return pwd_context.verify(plain_password, hashed_password)
+
+def verify_and_update_password(plain_password: str, hashed_password: str) -> tuple[bool, Optional[str]]:
+    """Verify a password; also return a new hash if the stored one uses a legacy scheme or cost."""
+    with password_hash_slots:
+        valid, new_hash = pwd_context.verify_and_update(plain_password, hashed_password)
+        if not valid:
+            # Pad with the other stored schemes, so every failed login costs the same as an
+            # unknown account whichever scheme this account's hash happens to use
+            verify_dummy_hashes(skip_scheme=pwd_context.identify(hashed_password))
+        return valid, new_hash
+
+@lru_cache(maxsize=1)
+def dummy_password_hashes() -> dict[str, str]:
+    """One dummy hash per scheme still stored, made at the cost real hashes of that scheme have."""
+    hashes = {"argon2": pwd_context.hash("dummy password")}
+    legacy_rounds = get_settings().LEGACY_BCRYPT_ROUNDS
+    if legacy_rounds:
+        # Unmigrated accounts still verify with bcrypt, which is far slower than Argon2
+        hashes["bcrypt"] = pwd_context.handler("bcrypt").using(rounds=legacy_rounds).hash("dummy password")
+    return hashes
+
+def verify_dummy_hashes(skip_scheme: Optional[str] = None):
+    """Verify against the dummy hash of every stored scheme except skip_scheme."""
+    for scheme, dummy_hash in dummy_password_hashes().items():
+        if scheme != skip_scheme:
+            pwd_context.verify("not the dummy password", dummy_hash)
+
+def dummy_verify_password():
+    """Spend a verification per stored scheme, so a missing account costs as much as the slowest real check."""
+    with password_hash_slots:
+        verify_dummy_hashes()
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """Create a JWT access token."""
     to_encode = data.copy()
-    if expires_delta:
-        expire = datetime.utcnow() + expires_delta
-    else:
-        expire = datetime.utcnow() + timedelta(minutes=15)
-    
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm="HS256")
+    # exp is integer seconds on the wire, so build it from the clock directly
+    expires_in = int(expires_delta.total_seconds()) if expires_delta else 900
+    to_encode["exp"] = int(time.time()) + expires_in
+    encoded_jwt = jwt.encode(to_encode, get_settings().SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 def verify_token(token: str) -> Optional[str]:
     """Verify a JWT token and return the subject."""
     try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
+        payload = jwt.decode(token, get_settings().SECRET_KEY, algorithms=[ALGORITHM])
         mobile_number: str = payload.get("sub")
         if mobile_number is None:
             return None
         return mobile_number
-    except JWTError:
+    except PyJWTError:
         return None
 
 def send_email(to_email: str, subject: str, message: str):
     """Send an email using SMTP."""
+    settings = get_settings()
     msg = MIMEMultipart()
     msg['From'] = settings.SENDER_EMAIL
     msg['To'] = to_email
@@ -110,9 +110,9 @@ def reset_database():
         Base.metadata.create_all(bind=engine)
         print("SUCCESS: All tables created")
         
-        # Mark as migrated
+        # Tables were created from the current models, so mark them as fully migrated
         return run_command(
-            "alembic stamp b90d767a4c25",
+            "alembic stamp head",
             "Mark database as migrated"
         )
         
@@ -0,0 +1,51 @@
+from decimal import Decimal
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.cache import active_packages_cache
+from app.database import get_db
+from app.main import app
+from app.models.models import Package
+
+engine = create_engine(
+    "sqlite://",
+    connect_args={"check_same_thread": False},
+    poolclass=StaticPool
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+
+def override_get_db():
+    db = TestingSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+def setup_module():
+    Package.__table__.create(engine)
+    app.dependency_overrides[get_db] = override_get_db
+
+def teardown_module():
+    app.dependency_overrides.pop(get_db, None)
+    Package.__table__.drop(engine)
+
+def test_plans_lists_free_demo_package():
+    db = TestingSessionLocal()
+    db.add_all([
+        Package(id="basic", name="Basic", duration=60, price=Decimal("500.00"), currency="TZS", is_active=True),
+        Package(id="demo", name="Demo Access", description="Free 15-minute trial", duration=15,
+                price=Decimal("0.00"), currency="TZS", is_active=True)
+    ])
+    db.commit()
+    db.close()
+    active_packages_cache.clear()
+
+    response = TestClient(app).get("/payment/plans")
+
+    assert response.status_code == 200
+    plans = {plan["id"]: plan for plan in response.json()["plans"]}
+    assert plans["demo"]["price"] == 0
+    assert plans["basic"]["price"] == 500